@@ -1,12 +1,17 @@
 import sys
 
 sys.path.append('../../')
+import functools
 import json
+import os
+import pickle
 import re
 import requests
-from os.path import abspath, expanduser, join, isfile, dirname
+from os.path import abspath, expanduser, join, isfile, dirname, getmtime
 
 import html2text
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_der_public_key
 from utlz import load_json, namedtuple, text_with_newlines
 from utlz.types import Enum
 
@@ -71,6 +76,9 @@ Log = namedtuple(
                                               text_with_newlines(text=self.key,
                                                                  line_length=64),
                                               '-----END PUBLIC KEY-----']),
+            # parsed only once per log, used for the SCT verification
+            'pubkey_cryptography': lambda self: load_der_public_key(
+                self.key_der, default_backend()),
             'scts_accepted_by_chrome':
                 lambda self:
                     None if self.state is None else
@@ -117,6 +125,19 @@ def Logs(log_dicts):
     return logs_out
 
 
+def logs_by_log_id(logs):
+    '''Return the logs as dict indexed by log ID, for a lookup of the log of an
+    SCT in O(1) instead of walking through all logs.
+
+    Args:
+        logs([<Log>, ...])
+
+    Return:
+        {<log_id_der>: <Log>, ...}
+    '''
+    return {log.log_id_der: log for log in logs}
+
+
 def set_operator_names(logs_dict):
     '''
         Fold the logs listing by operator into list of logs.
@@ -148,6 +169,9 @@ def set_operator_names(logs_dict):
                                 }
                             },
     '''
+    if 'operators' not in logs_dict:
+        # already folded, e.g. a memoized logs_dict of `read_log_list()`
+        return
     logs_dict['logs'] = []
     for operator in logs_dict['operators']:
         operator_name = operator['name']
@@ -166,6 +190,49 @@ BASE_URL = 'https://www.gstatic.com/ct/log_list/v2/'
 URL_LOG_LIST = BASE_URL + 'log_list.json'
 URL_ALL_LOGS = BASE_URL + 'all_logs_list.json'
 
+'''disk cache of parsed log lists'''
+LOG_LIST_CACHE = join(expanduser('~'), '.cache', 'ctzzy', 'loglist.pkl')
+
+
+def _read_log_list_cache():
+    '''Return the disk cache content as dict `{source: (validator, logs_dict)}`
+    where source is a filename or an URL and validator is the mtime of the file
+    or the ETag of the HTTP response.
+    '''
+    try:
+        with open(LOG_LIST_CACHE, 'rb') as fh:
+            return pickle.load(fh)
+    except (IOError, EOFError, ValueError, pickle.UnpicklingError):
+        return {}
+
+
+def cached_log_list(source, validator):
+    '''Return the cached logs_dict of `source` if it has been cached with the
+    same `validator`, else None.
+    '''
+    validator_cached, logs_dict = _read_log_list_cache().get(source,
+                                                             (None, None))
+    if validator is not None and validator == validator_cached:
+        return logs_dict
+    return None
+
+
+def cache_log_list(source, validator, logs_dict):
+    '''Store `logs_dict` of `source` with its `validator` in the disk cache.
+    A not writable cache is no error, the log list just will be parsed again
+    next time.
+    '''
+    cache = _read_log_list_cache()
+    cache[source] = (validator, logs_dict)
+    tmp_filename = LOG_LIST_CACHE + '.tmp'
+    try:
+        os.makedirs(dirname(LOG_LIST_CACHE), exist_ok=True)
+        with open(tmp_filename, 'wb') as fh:
+            pickle.dump(cache, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_filename, LOG_LIST_CACHE)
+    except (IOError, pickle.PicklingError) as exc:
+        logger.debug('could not write log list cache: %s' % exc)
+
 
 def download_log_list(url=URL_ALL_LOGS):
     '''Download json file with known logs accepted by chrome and return the
@@ -199,14 +266,25 @@ def download_log_list(url=URL_ALL_LOGS):
                                 }
                             },
     '''
-    response = requests.get(url)
+    etag_cached, data_cached = _read_log_list_cache().get(url, (None, None))
+    headers = {}
+    if etag_cached:
+        headers['If-None-Match'] = etag_cached
+    response = requests.get(url, headers=headers)
+    if response.status_code == 304 and data_cached is not None:
+        return data_cached
+
     response_str = response.text
     data = json.loads(response_str)
     data['url'] = url
 
+    etag = response.headers.get('ETag')
+    if etag:
+        cache_log_list(url, etag, data)
     return data
 
 
+@functools.lru_cache()
 def read_log_list(filename):
     '''Read log list from file `filename` and return as logs_dict.
 
@@ -232,10 +310,15 @@ def read_log_list(filename):
         }
     '''
     filename = abspath(expanduser(filename)) # exanduser 展开~路径
-    data = load_json(filename)
+    mtime = getmtime(filename)
+    data = cached_log_list(filename, mtime)
+    if data is None:
+        data = load_json(filename)
+        cache_log_list(filename, mtime, data)
     return data
 
 
+@functools.lru_cache()
 def get_log_list(list_name='really_all_logs.json'):
     '''Try to read log list from local file.  If file not exists download
         log list.
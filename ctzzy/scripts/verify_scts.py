@@ -12,23 +12,38 @@ import sys
 
 sys.path.append('../../')
 
+if __name__ == '__main__':
+    import importlib.util
+
+    # when calling `verify-scts` directly from source as pointed out in the
+    # README.md (section Devel-Commands) the c-code part needs to be compiled,
+    # else the import of the c-module `ctzzy.tls.handshake_openssl` by
+    # `ctzzy.tls.handshake` below would fail.  Once built, the compile step
+    # (and its startup time) is skipped.
+    if importlib.util.find_spec('ctzzy.tls.handshake_openssl') is None:
+        import ctzzy.tls.openssl_build
+
+        ctzzy.tls.openssl_build.compile()
+
 import argparse
+import asyncio
+import collections
 import logging
-import struct
 import os
 
-from pathlib import Path
-
 from utlz import first_paragraph, text_with_newlines
 
-from ctzzy.tls.handshake import do_handshake
+from ctzzy.tls.handshake import do_handshake_async
+from ctzzy.tls.handshake import cache_handshake_result, cached_handshake_result
+from ctzzy.tls.handshake import open_handshake_cache
 from ctzzy.ctlog import download_log_list, get_log_list, read_log_list
-from ctzzy.ctlog import Logs, set_operator_names
+from ctzzy.ctlog import Logs, logs_by_log_id, set_operator_names
 from ctzzy.sct.verification import verify_scts
 from ctzzy.sct.signature_input import create_signature_input_precert
 from ctzzy.sct.signature_input import create_signature_input
 from ctzzy.utils.string import to_hex
 from ctzzy.utils.logger import VERBOSE, init_logger, setup_logging, logger
+from ctzzy.utils.logger import BufferedOutput
 from ctzzy._version import __version__
 
 
@@ -44,6 +59,18 @@ def create_parser():
                         type=str,
                         metavar='',
                         help="A file that contains a list of domain names")
+    parser.add_argument('-c', '--concurrency',
+                        type=int,
+                        default=500,
+                        metavar='<n>',
+                        help='number of hosts to scrape and verify '
+                             'concurrently (default: 500)')
+    parser.add_argument('--no-cache',
+                        dest='use_cache',
+                        action='store_false',
+                        help='always do the TLS handshake, instead of using '
+                             'the result of a handshake of the last 24 hours '
+                             'to the same host (cached in ~/.cache/ctzzy)')
     meg = parser.add_mutually_exclusive_group()  # 创建一个互斥组。 argparse 将会确保互斥组中只有一个参数在命令行中可用
     meg.add_argument('--short',
                      dest='loglevel',
@@ -102,14 +129,20 @@ def verify_scts_by_cert(res, ctlogs):
     '''
     Args:
         res(ctzzy.tls.TlsHandshakeResult)
-        ctlogs([<ctzzy.ctlog.Log>, ...])
+        ctlogs([<ctzzy.ctlog.Log>, ...] or {<log_id_der>: <ctzzy.ctlog.Log>})
 
     Return:
         [<ctzzy.sct.verification.SctVerificationResult>, ...]
     '''
+    if res.ee_cert_der is None:
+        return []
+    scts = res.scts_by_cert
+    if not scts:
+        # nothing to verify, and no need to parse the issuer cert candidates
+        return []
     return verify_scts(
         ee_cert=res.ee_cert,
-        scts=res.scts_by_cert,
+        scts=scts,
         logs=ctlogs,  # CT 列表
         issuer_cert=res.issuer_cert,
         more_issuer_cert_candidates=res.more_issuer_cert_candidates,
@@ -120,11 +153,13 @@ def verify_scts_by_tls(res, ctlogs):
     '''
     Args:
         res(ctzzy.tls.TlsHandshakeResult)
-        ctlogs([<ctzzy.ctlog.Log>, ...])
+        ctlogs([<ctzzy.ctlog.Log>, ...] or {<log_id_der>: <ctzzy.ctlog.Log>})
 
     Return:
         [<ctzzy.sct.verification.SctVerificationResult>, ...]
     '''
+    if res.tls_ext_18_tdf is None:
+        return []
     return verify_scts(
         ee_cert=res.ee_cert,
         scts=res.scts_by_tls,
@@ -138,11 +173,13 @@ def verify_scts_by_ocsp(res, ctlogs):
     '''
     Args:
         res(ctzzy.tls.TlsHandshakeResult)
-        ctlogs([<ctzzy.ctlog.Log>, ...])
+        ctlogs([<ctzzy.ctlog.Log>, ...] or {<log_id_der>: <ctzzy.ctlog.Log>})
 
     Return:
         [<ctzzy.sct.verification.SctVerificationResult>, ...]
     '''
+    if res.ocsp_resp_der is None:
+        return []
     return verify_scts(
         ee_cert=res.ee_cert,
         scts=res.scts_by_ocsp,
@@ -158,107 +195,155 @@ verify_scts_by_tls.__name__ = 'SCTs by TLS'
 verify_scts_by_ocsp.__name__ = 'SCTs by OCSP'
 
 
-def show_signature_verbose(signature):
-    '''Print out signature as hex string to logger.verbose.
+def show_signature_verbose(signature, out):
+    '''Add signature as hex string to the verbose output `out`.
 
     Args:
         signature(bytes)
+        out(ctzzy.utils.logger.BufferedOutput)
     '''
-    sig_offset = 0
-    while sig_offset < len(signature):
-        if len(signature) - sig_offset > 16:
-            bytes_to_read = 16
-        else:
-            bytes_to_read = len(signature) - sig_offset
-        sig_bytes = struct.unpack_from('!%ds' % bytes_to_read,
-                                       signature,
-                                       sig_offset)[0]
+    sig = memoryview(signature)
+    for sig_offset in range(0, len(sig), 16):
+        sig_bytes = sig[sig_offset:sig_offset + 16]
         if sig_offset == 0:
-            logger.verbose('Signature : %s' % to_hex(sig_bytes))
+            out.verbose('Signature : %s' % to_hex(sig_bytes))
         else:
-            logger.verbose('            %s' % to_hex(sig_bytes))
-        sig_offset = sig_offset + bytes_to_read
+            out.verbose('            %s' % to_hex(sig_bytes))
 
 
-def show_verification(verification):
+def show_verification(verification, out):
     '''
     Args:
         verification(ctzzy.sct.verification.SctVerificationResult)
+        out(ctzzy.utils.logger.BufferedOutput)
     '''
     sct = verification.sct
 
-    sct_log_id1, sct_log_id2 = [to_hex(val)
-                                for val
-                                in struct.unpack("!16s16s", sct.log_id.tdf)]
-    logger.info('```')
-    logger.verbose('=' * 59)
-    logger.verbose('Version   : %s' % sct.version_hex)
-    logger.verbose('LogID     : %s' % sct_log_id1)
-    logger.verbose('            %s' % sct_log_id2)
-    logger.info('LogID b64 : %s' % sct.log_id_b64)
-    logger.verbose('Timestamp : %s (%s)' % (sct.timestamp, sct.timestamp_hex))
-    logger.verbose(
+    log_id = memoryview(sct.log_id.tdf)
+    sct_log_id1, sct_log_id2 = to_hex(log_id[:16]), to_hex(log_id[16:])
+    out.info('```')
+    out.verbose('=' * 59)
+    out.verbose('Version   : %s' % sct.version_hex)
+    out.verbose('LogID     : %s' % sct_log_id1)
+    out.verbose('            %s' % sct_log_id2)
+    out.info('LogID b64 : %s' % sct.log_id_b64)
+    out.verbose('Timestamp : %s (%s)' % (sct.timestamp, sct.timestamp_hex))
+    out.verbose(
         'Extensions: %d (%s)' % (sct.extensions_len, sct.extensions_len_hex))
-    logger.verbose('Algorithms: %s/%s (hash/sign)' % (sct.signature_alg_hash_hex, sct.signature_algorithm_signature))
+    out.verbose('Algorithms: %s/%s (hash/sign)' % (sct.signature_alg_hash_hex, sct.signature_algorithm_signature))
 
-    show_signature_verbose(sct.signature)
+    show_signature_verbose(sct.signature, out)
     prefix = 'Sign. b64 : '
-    logger.info(prefix + text_with_newlines(sct.signature_b64, line_length=16 * 3,
-                                            newline='\n' + ' ' * len(prefix)))
+    out.info(prefix + text_with_newlines(sct.signature_b64, line_length=16 * 3,
+                                         newline='\n' + ' ' * len(prefix)))
 
-    logger.verbose('--')  # visual gap between sct infos and verification result
+    out.verbose('--')  # visual gap between sct infos and verification result
 
     log = verification.log
     if log is None:
-        logger.info('Log not found\n')
+        out.info('Log not found\n')
     else:
-        logger.info('Log found : %s' % log.description)
-        logger.verbose('Operator  : %s' % log.operated_by['name'])
-        logger.info('Chrome    : %s' % log.scts_accepted_by_chrome)
+        out.info('Log found : %s' % log.description)
+        out.verbose('Operator  : %s' % log.operated_by['name'])
+        out.info('Chrome    : %s' % log.scts_accepted_by_chrome)
 
     if verification.verified:
-        logger.info('Result    : Verified OK')
-        logger.verbose('Result    : Verified OK')
+        out.info('Result    : Verified OK')
+        out.verbose('Result    : Verified OK')
     else:
-        logger.info('Result    : Verification Failure')
-        logger.verbose('Result    : Verification Failure')
-
-    logger.info('```\n')
-
+        out.info('Result    : Verification Failure')
+        out.verbose('Result    : Verification Failure')
+
+    out.info('```\n')
+
+
+async def scrape_and_verify_scts_async(hostname, verification_tasks, ctlogs,
+                                       cache=None, out=None):
+    scts_tls = verify_scts_by_tls in verification_tasks
+    scts_ocsp = verify_scts_by_ocsp in verification_tasks
+    res = cached_handshake_result(cache, hostname, 443, scts_tls, scts_ocsp)
+    cached = res is not None
+    if not cached:
+        res = await do_handshake_async(hostname, 443,
+                                       scts_tls=scts_tls, scts_ocsp=scts_ocsp)
+        cache_handshake_result(cache, hostname, 443, scts_tls, scts_ocsp, res)
+    # no await from here on, so the output of the hosts is not interleaved
+    show_and_verify_scts(hostname, res, verification_tasks, ctlogs, cached,
+                         out)
+
+
+async def scrape_and_verify_all(hostnames, verification_tasks, ctlogs,
+                                concurrency, cache=None):
+    '''Scrape and verify the SCTs of all `hostnames`, with up to `concurrency`
+    handshakes in flight at the same time.
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape_and_verify(hostname):
+        out = BufferedOutput()
+        async with semaphore:
+            try:
+                await scrape_and_verify_scts_async(hostname,
+                                                   verification_tasks,
+                                                   ctlogs, cache, out)
+            except Exception as exc:
+                # a broken host must not abort the handshakes of all others
+                out.flush()
+                logger.warning('%s: %s' % (hostname, exc))
+
+    await asyncio.gather(*[scrape_and_verify(hostname)
+                           for hostname
+                           in hostnames])
+
+
+def show_and_verify_scts(hostname, res, verification_tasks, ctlogs,
+                         cached=False, out=None):
+    '''
+    Args:
+        hostname(str)
+        res(ctzzy.tls.TlsHandshakeResult)
+        verification_tasks([<verify_scts_by_cert|_tls|_ocsp>, ...])
+        ctlogs([<ctzzy.ctlog.Log>, ...] or {<log_id_der>: <ctzzy.ctlog.Log>})
+        cached(bool): True, if `res` is a cached handshake result
+        out(ctzzy.utils.logger.BufferedOutput): collects the output of the
+                                                host, if given
+    '''
+    if out is None:
+        out = BufferedOutput()
+    out.info('# %s\n' % hostname)
 
-def scrape_and_verify_scts(hostname, verification_tasks, ctlogs):
-    logger.info('# %s\n' % hostname)
+    if cached:
+        out.info('* cached handshake result')
 
-    res = do_handshake(hostname, 443,
-                       scts_tls=(verify_scts_by_tls in verification_tasks),
-                       scts_ocsp=(verify_scts_by_ocsp in verification_tasks))
     if res.ee_cert_der:
-        logger.debug('got certificate\n')
+        out.debug('got certificate\n')
         if res.ee_cert.is_ev_cert:
-            logger.info('* EV cert')
-            logger.verbose('EV cert     : True')
+            out.info('* EV cert')
+            out.verbose('EV cert     : True')
         else:
-            logger.info('* no EV cert')
-            logger.verbose('EV cert     : False')
+            out.info('* no EV cert')
+            out.verbose('EV cert     : False')
         if res.ee_cert.is_letsencrypt_cert:
-            logger.info("* issued by Let's Encrypt\n")
-            logger.verbose("issued by Let's Encrypt: True")
+            out.info("* issued by Let's Encrypt\n")
+            out.verbose("issued by Let's Encrypt: True")
         else:
-            logger.info("* not issued by Let's Encrypt\n")
-            logger.verbose("issued by Let's Encrypt: False")
+            out.info("* not issued by Let's Encrypt\n")
+            out.verbose("issued by Let's Encrypt: False")
 
     if res.err:
+        out.flush()
         logger.warning(res.err)
     else:
         for verification_task in verification_tasks:
-            logger.info('## %s\n' % verification_task.__name__)
-            logger.verbose('## %s\n' % verification_task.__name__)
+            out.info('## %s\n' % verification_task.__name__)
+            out.verbose('## %s\n' % verification_task.__name__)
             verifications = verification_task(res, ctlogs)
             if verifications:
                 for verification in verifications:
-                    show_verification(verification)
+                    show_verification(verification, out)
             elif res.ee_cert_der is not None:
-                logger.info('no SCTs\n')
+                out.info('no SCTs\n')
+    out.flush()
 
 
 def main():
@@ -269,30 +354,31 @@ def main():
     logger.debug(args)
 
     # set ctlogs, type: [<ctzzy.ctlog.Log>, ...]
-    all_dict = args.fetch_ctlogs()  # call download_log_list() to populate the list
-    set_operator_names(all_dict)
-    ctlogs = Logs([all_dict])
     if args.log_list_filename:
         logs_dict = read_log_list(args.log_list_filename)
-        set_operator_names(logs_dict)
-        ctlogs = Logs(logs_dict['logs'])
-    if os.path.isfile(Path(args.domainfile)):
+    else:
+        logs_dict = args.fetch_ctlogs()  # download_log_list() or get_log_list()
+    set_operator_names(logs_dict)
+    ctlogs = logs_by_log_id(Logs([logs_dict]))
+    if os.path.isfile(args.domainfile):
         with open(args.domainfile, 'r') as f:
-            host = f.readline()
-            while host:
-                scrape_and_verify_scts(host, args.verification_tasks, ctlogs)
-                host = f.readline()
-        f.close()
+            # strip the newline, else it would become part of the SNI
+            hosts = (host for host in (line.strip() for line in f) if host)
+            # drop duplicates, keep the order
+            hosts = collections.OrderedDict.fromkeys(hosts).keys()
+        cache = open_handshake_cache() if args.use_cache else None
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                scrape_and_verify_all(hosts, args.verification_tasks,
+                                      ctlogs, args.concurrency, cache))
+        finally:
+            loop.close()
+            if cache is not None:
+                cache.close()
     else:
         print("Please enter the correct file!")
 
 
 if __name__ == '__main__':
-    # when calling `verify-scts` directly from source as pointed out in the
-    # README.md (section Devel-Commands) the c-code part needs to be compiled,
-    # else the import of the c-module `ctzzy.tls.handshake_openssl` would fail.
-    import ctzzy.tls.openssl_build
-
-    ctzzy.tls.openssl_build.compile()
-
     main()
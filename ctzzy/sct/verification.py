@@ -3,9 +3,10 @@ import sys
 sys.path.append('../../')
 import collections
 
+from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.backends.openssl.backend import backend
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import ec, dsa, rsa
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, dsa, padding, rsa
 from OpenSSL.crypto import verify, X509, PKey, Error as OpenSSL_crypto_Error
 
 SctVerificationResult = collections.namedtuple(
@@ -20,6 +21,14 @@ SctVerificationResult = collections.namedtuple(
 
 
 def find_log(sct, logs):
+    '''
+    Args:
+        sct(ctzzy.rfc6962.SignedCertificateTimestamp)
+        logs([<ctzzy.ctlog.Log>, ...] or {<log_id_der>: <ctzzy.ctlog.Log>, ...}
+             as created by `ctzzy.ctlog.logs_by_log_id()`)
+    '''
+    if isinstance(logs, dict):
+        return logs.get(sct.log_id.tdf)
     for log in logs:
         if log.log_id_der == sct.log_id.tdf:
             return log
@@ -80,15 +89,45 @@ def verify_signature(signature_input, signature,
     return True
 
 
+def verify_signature_by_pubkey(signature_input, signature, pubkey,
+                               digest_algo=hashes.SHA256()):
+    '''Same as `verify_signature()`, but `pubkey` is an already loaded
+    pubkey of cryptography, for example `ctzzy.ctlog.Log.pubkey_cryptography`.
+
+    Args:
+        signature_input(bytes): signed data
+        signature(bytes):
+        pubkey(ec.EllipticCurvePublicKey or rsa.RSAPublicKey)
+        digest_algo(hashes.HashAlgorithm): used digest hash algorithm
+                                           (default: SHA256)
+
+    Return:
+        True, if signature could be verified
+        False, else
+    '''
+    try:
+        if isinstance(pubkey, ec.EllipticCurvePublicKey):
+            pubkey.verify(signature, signature_input, ec.ECDSA(digest_algo))
+        elif isinstance(pubkey, rsa.RSAPublicKey):
+            pubkey.verify(signature, signature_input, padding.PKCS1v15(),
+                          digest_algo)
+        else:
+            raise TypeError("Unsupported key type")
+    except InvalidSignature:
+        return False
+    return True
+
+
 def verify_sct(ee_cert, sct, logs,
                issuer_cert, more_issuer_cert_candidates,
                sign_input_func):
     log = find_log(sct,logs)
     if log:
-        verified = verify_signature(
+        pubkey = log.pubkey_cryptography
+        verified = verify_signature_by_pubkey(
             signature_input=sign_input_func(ee_cert, sct, issuer_cert),
             signature=sct.signature,
-            pubkey_pem=log.pubkey.encode('ascii'))
+            pubkey=pubkey)
 
         if not verified and more_issuer_cert_candidates is not None:
             # Sometimes the certificate chain is disordered (this is only
@@ -97,10 +136,10 @@ def verify_sct(ee_cert, sct, logs,
 
             # Try to verify against all other certs of the chain (candidates).
             for issuer_cert in more_issuer_cert_candidates:
-                verified = verify_signature(
+                verified = verify_signature_by_pubkey(
                     signature_input=sign_input_func(ee_cert, sct, issuer_cert),
                     signature=sct.signature,
-                    pubkey_pem=log.pubkey.encode('ascii'))
+                    pubkey=pubkey)
                 if verified:
                     break
         return SctVerificationResult(ee_cert, sct, log, verified)
@@ -116,4 +155,4 @@ def verify_scts(ee_cert, scts, logs,
                            sign_input_func)
                 for sct
                 in scts]
-    return []
\ No newline at end of file
+    return []
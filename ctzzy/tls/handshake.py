@@ -1,23 +1,102 @@
 import sys
 
 sys.path.append('../../')
+import asyncio
 import binascii
+import collections
+import dbm
+import errno
+import functools
+import os
+import re
+import shelve
 import socket
 import struct
-from functools import reduce
+import time
+from os.path import dirname, expanduser, join
 
 import certifi
 import OpenSSL
+import pyasn1.error
 import pyasn1_modules.rfc2560
 import pyasn1_modules.rfc5280
+from cryptography import x509
+from cryptography.hazmat.backends import default_backend
+from cryptography.x509 import ocsp
 from pyasn1.codec import ber
 from pyasn1.codec.der.decoder import decode as der_decoder
 from pyasn1.type.univ import ObjectIdentifier, OctetString, Sequence
-from utlz import flo, namedtuple
 
 from ctzzy.rfc6962 import SignedCertificateTimestamp
 from ctzzy.sct.ee_cert import EndEntityCert, IssuerCert
+from ctzzy.tls.handshake_openssl import ffi, lib
 from ctzzy.tls.sctlist import SignedCertificateTimestampList, TlsExtension18
+from ctzzy.utils.logger import logger
+
+# OIDs of the SCTList extension of a certificate and of an OCSP response
+# (RFC 6962, section 3.3), for pyasn1 and for cryptography
+_SCT_LIST_OID = ObjectIdentifier(value='1.3.6.1.4.1.11129.2.4.2')
+_OCSP_SCT_OID = ObjectIdentifier(value='1.3.6.1.4.1.11129.2.4.5')
+_SCT_LIST_X509_OID = x509.ObjectIdentifier('1.3.6.1.4.1.11129.2.4.2')
+_OCSP_SCT_X509_OID = x509.ObjectIdentifier('1.3.6.1.4.1.11129.2.4.5')
+
+
+def scts_from_sctlist_os_der(sctlist_os_der):
+    '''Return list of SCTs of the SCTList contained in the DER encoded
+    OctetString `sctlist_os_der` (the extnValue of an SCTList extension).
+
+    Return:
+        [<ctzzy.rfc6962.SignedCertificateTimestamp>, ...]
+    '''
+    sctlist_os, _ = der_decoder(sctlist_os_der, OctetString())
+    sctlist_der = bytes(sctlist_os)
+
+    sctlist = SignedCertificateTimestampList(sctlist_der)
+    return [SignedCertificateTimestamp(entry.sct_der)
+            for entry
+            in sctlist.sct_list]
+
+
+def extension_value_der(extension):
+    '''Return the DER encoded extnValue of the `cryptography.x509.Extension`.
+
+    Raise ValueError if the cryptography version is too old to re-encode a
+    parsed extension.
+    '''
+    value = extension.value
+    if isinstance(value, x509.UnrecognizedExtension):
+        return value.value
+    public_bytes = getattr(value, 'public_bytes', None)
+    if public_bytes is None:
+        raise ValueError('cannot re-encode %s' % type(value).__name__)
+    return public_bytes()
+
+
+def sctlist_os_der_from_cert(cert_der):
+    '''Return the extnValue (a DER encoded OctetString) of the SCTList
+    extension of the certificate, or None if there is no such extension.
+
+    Parsed with the X.509 parser of cryptography; raise ValueError if the
+    certificate could not be parsed.
+    '''
+    cert = x509.load_der_x509_certificate(cert_der, default_backend())
+    try:
+        extension = cert.extensions.get_extension_for_oid(_SCT_LIST_X509_OID)
+    except x509.ExtensionNotFound:
+        return None
+    return extension_value_der(extension)
+
+
+def sctlist_os_der_from_cert_pyasn1(cert_der):
+    '''Same as `sctlist_os_der_from_cert()`, parsed with pyasn1.'''
+    cert, _ = der_decoder(
+        cert_der, asn1Spec=pyasn1_modules.rfc5280.Certificate())
+    extensions = cert['tbsCertificate'].getComponentByName('extensions')
+    if extensions.isValue:
+        for extension in extensions:
+            if extension['extnID'] == _SCT_LIST_OID:
+                return bytes(extension['extnValue'])
+    return None
 
 
 def scts_from_cert(cert_der):
@@ -29,75 +108,125 @@ def scts_from_cert(cert_der):
     Return:
         [<ctzzy.rfc6962.SignedCertificateTimestamp>, ...]
     '''
-    cert, _ = der_decoder(
-        cert_der, asn1Spec=pyasn1_modules.rfc5280.Certificate())
-    sctlist_oid = ObjectIdentifier(value='1.3.6.1.4.1.11129.2.4.2')
-    exts = []
-    if 'extensions' in cert['tbsCertificate'].keys():
-        exts = [extension
-                for extension
-                in cert['tbsCertificate']['extensions']
-                if extension['extnID'] == sctlist_oid]
-
-    if len(exts) != 0:
-        extension_sctlist = exts[0]
-        os_inner_der = extension_sctlist['extnValue']
-        os_inner, _ = der_decoder(os_inner_der, OctetString())
-        sctlist_hex = os_inner.prettyPrint().split('0x')[-1]
-        sctlist_der = binascii.unhexlify(sctlist_hex)
-
-        sctlist = SignedCertificateTimestampList(sctlist_der)
-        return [SignedCertificateTimestamp(entry.sct_der)
-                for entry
-                in sctlist.sct_list]
+    try:
+        sctlist_os_der = sctlist_os_der_from_cert(cert_der)
+    except ValueError:
+        # rejected by cryptography, maybe pyasn1 is less strict
+        sctlist_os_der = sctlist_os_der_from_cert_pyasn1(cert_der)
 
+    if sctlist_os_der:
+        return scts_from_sctlist_os_der(sctlist_os_der)
     return []
 
 
-def sctlist_hex_from_ocsp_pretty_print(ocsp_resp):
-    sctlist_hex = None
-    splitted = ocsp_resp.split('<no-name>=1.3.6.1.4.1.11129.2.4.5', 1)
-    if len(splitted) > 1:
-        _, after = splitted
-        _, sctlist_hex_with_rest = after.split('<no-name>=0x', 1)
-        sctlist_hex, _ = sctlist_hex_with_rest.split('\n', 1)
-    return sctlist_hex
-
+def sctlist_os_der_from_basic_ocsp_response(response_der):
+    '''Return the value of the SCTList extension (OID 1.3.6.1.4.1.11129.2.4.5)
+    of the OCSP response, or None if there is no such extension.
 
-def scts_from_ocsp_resp(ocsp_resp_der):
-    '''Return list of SCTs of the OCSP status response.
+    The extension is searched in the singleExtensions of each SingleResponse
+    and in the responseExtensions of the ResponseData.
 
     Args:
-        ocsp_resp_der(bytes): DER encoded OCSP status response
+        response_der(bytes): DER encoded BasicOCSPResponse
 
     Return:
-        [<ctzzy.rfc6962.SignedCertificateTimestamp>, ...]
+        (bytes): DER encoded OctetString which contains the SCTList
     '''
-    if ocsp_resp_der:
-        ocsp_resp,_ = der_decoder(
-            ocsp_resp_der,asn1Spec=pyasn1_modules.rfc2560.OCSPResponse())
+    response, _ = der_decoder(
+        response_der, asn1Spec=pyasn1_modules.rfc2560.BasicOCSPResponse())
+    response_data = response['tbsResponseData']
+    extensions_lists = [single_response['singleExtensions']
+                        for single_response
+                        in response_data['responses']]
+    extensions_lists.append(response_data['responseExtensions'])
+
+    for extensions in extensions_lists:
+        for extension in extensions:
+            if extension['extnID'] == _OCSP_SCT_OID:
+                return bytes(extension['extnValue'])
+    return None
+
+
+# the hex dump of the first value following the SCTList extension OID in a
+# pyasn1 pretty print
+_SCT_OCSP_RE = re.compile(
+    r'<no-name>=1\.3\.6\.1\.4\.1\.11129\.2\.4\.5.*?<no-name>=0x([0-9a-fA-F]+)',
+    re.S)
+
+
+def sctlist_hex_from_ocsp_pretty_print(ocsp_resp):
+    match = _SCT_OCSP_RE.search(ocsp_resp)
+    if match:
+        return match.group(1)
+    return None
 
-        response_bytes = ocsp_resp.getComponentByName('responseBytes')
-        if response_bytes is not None:
-            # os: octet string
-            response_os = response_bytes.getComponentByName('response')
 
+def sctlist_os_der_from_ocsp_resp(ocsp_resp_der):
+    '''Return the extnValue (a DER encoded OctetString) of the SCTList
+    extension of the OCSP status response, or None if there is no such
+    extension.
+
+    Parsed with the OCSP parser of cryptography; raise ValueError if the
+    response could not be parsed (or has more than one SingleResponse).
+    '''
+    ocsp_resp = ocsp.load_der_ocsp_response(ocsp_resp_der)
+    if ocsp_resp.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+        return None
+    for extensions in [ocsp_resp.single_extensions, ocsp_resp.extensions]:
+        try:
+            extension = extensions.get_extension_for_oid(_OCSP_SCT_X509_OID)
+        except x509.ExtensionNotFound:
+            continue
+        return extension_value_der(extension)
+    return None
+
+
+def sctlist_os_der_from_ocsp_resp_pyasn1(ocsp_resp_der):
+    '''Same as `sctlist_os_der_from_ocsp_resp()`, parsed with pyasn1.'''
+    ocsp_resp,_ = der_decoder(
+        ocsp_resp_der,asn1Spec=pyasn1_modules.rfc2560.OCSPResponse())
+
+    sctlist_os_der = None
+    response_bytes = ocsp_resp.getComponentByName('responseBytes')
+    if response_bytes is not None:
+        # os: octet string
+        response_os = response_bytes.getComponentByName('response')
+
+        try:
+            sctlist_os_der = sctlist_os_der_from_basic_ocsp_response(
+                response_os)
+        except pyasn1.error.PyAsn1Error:
+            # not decodable as BasicOCSPResponse, so search the (schemaless
+            # decoded) response for the extension
             der_decoder.defaultErrorState = ber.decoder.stDumpRawValue
             response,_ = der_decoder(response_os, Sequence())
 
             sctlist_os_hex = sctlist_hex_from_ocsp_pretty_print(
                 response.prettyPrint())
-
             if sctlist_os_hex:
                 sctlist_os_der = binascii.unhexlify(sctlist_os_hex)
-                sctlist_os,_ = der_decoder(sctlist_os_der, OctetString())
-                sctlist_hex = sctlist_os.prettyPrint().split('0x')[-1]
-                sctlist_der = binascii.unhexlify(sctlist_hex)
-
-                sctlist = SignedCertificateTimestampList(sctlist_der)
-                return [SignedCertificateTimestamp(entry.sct_der)
-                        for entry
-                        in sctlist.sct_list]
+    return sctlist_os_der
+
+
+def scts_from_ocsp_resp(ocsp_resp_der):
+    '''Return list of SCTs of the OCSP status response.
+
+    Args:
+        ocsp_resp_der(bytes): DER encoded OCSP status response
+
+    Return:
+        [<ctzzy.rfc6962.SignedCertificateTimestamp>, ...]
+    '''
+    if ocsp_resp_der:
+        try:
+            sctlist_os_der = sctlist_os_der_from_ocsp_resp(ocsp_resp_der)
+        except ValueError:
+            # rejected by cryptography, maybe pyasn1 is less strict
+            sctlist_os_der = sctlist_os_der_from_ocsp_resp_pyasn1(
+                ocsp_resp_der)
+
+        if sctlist_os_der:
+            return scts_from_sctlist_os_der(sctlist_os_der)
     return []
 
 
@@ -122,17 +251,66 @@ def scts_from_tls_ext_18(tls_ext_18_tdf):
     return scts
 
 
+# return the DER encoding (bytes) of an <OpenSSL.crypto.X509>
+cert_der_from_x509 = functools.partial(OpenSSL.crypto.dump_certificate,
+                                       OpenSSL.crypto.FILETYPE_ASN1)
+
+
+class _LazyVal(object):
+    '''A property which is calculated by `func` on first access and then
+    memoized in the `__dict__` of the instance.
+    '''
+
+    def __init__(self, name, func):
+        self.name = name
+        self.func = func
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        # not a data descriptor, so on the next access the instance attribute
+        # shadows this property
+        val = instance.__dict__[self.name] = self.func(instance)
+        return val
+
+
+def namedtuple(typename, field_names, lazy_vals):
+    '''Like `utlz.namedtuple()`, but the lazy vals are memoized per instance.
+
+    utlz memoizes the lazy vals in a class level dict, together with a
+    del-hook which references the instance, so an instance with a computed
+    lazy val is never freed.  Here, they are freed together with the
+    instance.
+    '''
+    _class = collections.namedtuple(typename, field_names)
+    # no `__slots__` in the subclass, so its instances have a `__dict__`
+    return type(typename, (_class,), {
+        attr_name: _LazyVal(attr_name, func)
+        for attr_name, func
+        in lazy_vals.items()})
+
+
 TlsHandshakeResult = namedtuple(
     typename='TlsHandshakeResult',
     field_names=[
         'ee_cert_der',      # (bytes)
         'issuer_cert_der',  # (bytes) 发布者的证书？
-        'more_issuer_cert_der_candidates',  # [(bytes), ...]
+        'more_issuer_cert_x509_candidates',  # [<OpenSSL.crypto.X509>, ...]
         'ocsp_resp_der',    # (bytes)
         'tls_ext_18_tdf',   # (bytes)
         'err',              # (str)
+        # [(bytes), ...] the DER encoded candidates, if already at hand (e.g.
+        # from the handshake cache), else None
+        'more_issuer_cert_ders',
     ],
     lazy_vals={
+        # DER encode the candidates only if they are needed
+        'more_issuer_cert_der_candidates': lambda self: (  # [(bytes), ...]
+            self.more_issuer_cert_ders
+            if self.more_issuer_cert_ders is not None
+            else list(map(cert_der_from_x509,
+                          self.more_issuer_cert_x509_candidates))),
+
         'ee_cert': lambda self: EndEntityCert(self.ee_cert_der),
         'issuer_cert': lambda self: IssuerCert(self.issuer_cert_der),
         'more_issuer_cert_candidates': lambda self: [
@@ -146,6 +324,20 @@ TlsHandshakeResult = namedtuple(
     }
 )
 
+TlsHandshakeResult.__new__.__defaults__ = (None,)  # more_issuer_cert_ders
+
+
+# The SSL context is shared by all handshakes (cf. `cached_context()`), so
+# the callbacks must not store their results in it.  The TLS extension 18
+# callback only gets the raw SSL struct, so its results are stored here keyed
+# by the address of the SSL struct of the connection.
+_tls_ext_18_tdfs = {}
+
+
+def ssl_address(ssl):
+    '''Return the address of the SSL struct `ssl` (cffi pointer) as int.'''
+    return int(ffi.cast('uintptr_t', ssl))
+
 
 def create_socket(ctx):
     '''
@@ -153,7 +345,9 @@ def create_socket(ctx):
         ctx(OpenSSL.SSL.Context): OpenSSL context object
     '''
     raw_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    return OpenSSL.SSL.Connection(context=ctx, socket=raw_sock)
+    conn = OpenSSL.SSL.Connection(context=ctx, socket=raw_sock)
+    conn.ocsp_resp_der = None  # set by the OCSP client callback
+    return conn
 
 
 def create_context(scts_tls, scts_ocsp, timeout):
@@ -167,50 +361,48 @@ def create_context(scts_tls, scts_ocsp, timeout):
     def verify_callback(conn, cert, errnum, depth, ok):
         return 1  # True
 
-    ctx = OpenSSL.SSL.Context(OpenSSL.SSL.TLSv1_2_METHOD)
+    ctx = OpenSSL.SSL.Context(OpenSSL.SSL.TLS_METHOD)
+    ctx.set_min_proto_version(OpenSSL.SSL.TLS1_2_VERSION)
 
     ctx.set_verify(OpenSSL.SSL.VERIFY_PEER, verify_callback)
     ca_filename = certifi.where()  # 用来返回cacert.pem的路径
     ctx.load_verify_locations(ca_filename)  # 验证证书的有效性
 
-    ctx.tls_ext_18_tdf = None  # 不懂
     if scts_tls:
-        from ctzzy.tls.handshake_openssl import ffi, lib  # 完全不懂
-
         @ffi.def_extern()
-        def serverinfo_cli_parse_cb(ssl, ext_type, _in, inlen, al, arg):
-            if ext_type == 18:
-                def reduce_func(accum_value, current):
-                    fmt = accum_value[0] + current[0]
-                    values = accum_value[1] + (current[1],)
-                    return fmt, values
-
-                initializer = ('!', ())
-                fmt, values = reduce(reduce_func[
-                                         ('H', ext_type),
-                                         ('H', inlen),
-                                         (flo('{inlen}s'), bytes(ffi.buffer(_in, inlen))),
-                                     ], initializer)
-                ctx.tls_ext_18_tdf = struct.pack(fmt, *values)
+        def serverinfo_cli_parse_cb(ssl, ext_type, context, _in, inlen,
+                                    x, chainidx, al, arg):
+            # in TLS 1.3 the extension is sent per certificate of the chain,
+            # the SCTs are the ones of the end entity certificate
+            if ext_type == 18 and chainidx == 0:
+                _tls_ext_18_tdfs[ssl_address(ssl)] = struct.pack(
+                    '!HH%ds' % inlen,
+                    ext_type, inlen, bytes(ffi.buffer(_in, inlen)))
             return 1  # True
 
         # register callback for TLS extension result into the SSL context
-        # created with PyOpenSSL, using OpenSSL "directly"
-        if not lib.SSL_CTX_add_client_custom_ext(ffi.cast('struct ssl_ctx_st *',
-                                                          ctx._context),
-                                                 18,
-                                                 ffi.NULL, ffi.NULL, ffi.NULL,
-                                                 lib.serverinfo_cli_parse_cb,
-                                                 ffi.NULL):
+        # created with PyOpenSSL, using OpenSSL "directly".  The extension is
+        # sent empty in the ClientHello (no add callback) and the reply is
+        # parsed from the ServerHello (TLS 1.2) or from the Certificate
+        # message (TLS 1.3)
+        context = (lib.SSL_EXT_CLIENT_HELLO |
+                   lib.SSL_EXT_TLS1_2_SERVER_HELLO |
+                   lib.SSL_EXT_TLS1_3_CERTIFICATE |
+                   lib.SSL_EXT_IGNORE_ON_RESUMPTION)
+        if not lib.SSL_CTX_add_custom_ext(ffi.cast('struct ssl_ctx_st *',
+                                                   ctx._context),
+                                          18, context,
+                                          ffi.NULL, ffi.NULL, ffi.NULL,
+                                          lib.serverinfo_cli_parse_cb,
+                                          ffi.NULL):
             import sys
             sys.stderr.write('Unable to add custom extension 18\n')
             lib.ERR_print_errors_fp(sys.stderr)
             sys.exit(1)
 
-    ctx.ocsp_resp_der = None
     if scts_ocsp:
         def ocsp_client_callback(connection, ocsp_data, data):
-            ctx.ocsp_resp_der = ocsp_data
+            connection.ocsp_resp_der = ocsp_data
             return True
 
         ctx.set_ocsp_client_callback(ocsp_client_callback, data=None)
@@ -220,80 +412,258 @@ def create_context(scts_tls, scts_ocsp, timeout):
     return ctx
 
 
-def do_handshake(domain, port=443, scts_tls=True, scts_ocsp=True, timeout=5):
+@functools.lru_cache(maxsize=4)
+def cached_context(scts_tls, scts_ocsp, timeout):
+    '''Return the SSL context created by `create_context()` for these args,
+    created only once and reused for all handshakes.
+
+    Loading the CA bundle and registering the callbacks is done only once this
+    way; the per connection results of the callbacks are stored at the
+    connection (OCSP) or in `_tls_ext_18_tdfs` (TLS extension 18).
     '''
-     Args:
-         domain: string with domain name,
-                 for example: 'ritter.vg', or 'www.ritter.vg'
-         scts_tls: If True, register callback for TSL extension 18 (for SCTs)
-         scts_ocsp: If True, register callback for OCSP-response (for SCTs)
-         timeout(int): timeout in seconds
-     '''
-    ctx = create_context(scts_tls, scts_ocsp, timeout)
+    return create_context(scts_tls, scts_ocsp, timeout)
+
+
+def create_connection(domain, scts_tls, scts_ocsp, timeout):
+    '''Return a TLS connection to `domain`, ready for connect and handshake.
+
+    Args:
+        domain: string with domain name
+        scts_tls: If True, register callback for TSL extension 18 (for SCTs)
+        scts_ocsp: If True, register callback for OCSP-response (for SCTs)
+        timeout(int): timeout in seconds
+
+    Return:
+        OpenSSL.SSL.Connection
+    '''
+    ctx = cached_context(scts_tls, scts_ocsp, timeout)
     sock = create_socket(ctx)
     sock.set_tlsext_host_name(domain.encode())
     sock.request_ocsp()
-    sock.set_tlsext_host_name(domain.encode())
+    return sock
+
+
+def error_message(domain, exc):
+    exc_str = str(exc)
+    if exc_str == '':
+        exc_str = str(type(exc))
+    return domain + ': ' + exc_str
+
 
+def handshake_result(domain, sock, scts_tls, scts_ocsp, err=''):
+    '''Collect the results of the handshake of connection `sock` and close it.
+
+    Args:
+        domain: string with domain name
+        sock(OpenSSL.SSL.Connection): connection created by
+                                      `create_connection()`
+        scts_tls: If True, the callback for TSL extension 18 was registered
+        scts_ocsp: If True, the callback for OCSP-response was registered
+        err(str): error message of the connect or handshake, if any
+
+    Return:
+        TlsHandshakeResult
+    '''
     issuer_cert_x509 = None
     more_issuer_cert_x509_candidates = []
     ee_cert_x509 = None
     ocsp_resp_der = None
     tls_ext_18_tdf = None
-    err = ''
 
     try:
-        sock.connect((domain, port))
-        sock.do_handshake()
+        if not err:
+            # ee:end entity 叶子证书，终端的证书
+            ee_cert_x509 = sock.get_peer_certificate()
 
-        # ee:end entity 叶子证书，终端的证书
-        ee_cert_x509 = sock.get_peer_certificate()
+            # [x509, ...]
+            chain_x509s = sock.get_peer_cert_chain()
+            if len(chain_x509s) > 1:
+                issuer_cert_x509 = chain_x509s[1]  # root cert?
+            more_issuer_cert_x509_candidates = [ee_cert_x509] + chain_x509s
+            logger.debug('%s: chain length: %d', domain, len(chain_x509s))
 
-        # [x509, ...]
-        chain_x509s = sock.get_peer_cert_chain()
-        if len(chain_x509s) > 1:
-            issuer_cert_x509 = chain_x509s[1]  # root cert?
-        more_issuer_cert_x509_candidates = [ee_cert_x509] + chain_x509s
-        print("debug: len(chain_x509s) = %d" % len(chain_x509s))
-
-        ctx = sock.get_context()
-        if scts_tls:
-            if ctx.tls_ext_18_tdf:
-                tls_ext_18_tdf = ctx.tls_ext_18_tdf
-
-        if scts_ocsp:
-            if ctx.ocsp_resp_der:
-                ocsp_resp_der = ctx.ocsp_resp_der
+            if scts_ocsp:
+                if sock.ocsp_resp_der:
+                    ocsp_resp_der = sock.ocsp_resp_der
 
     except Exception as exc:
-        exc_str = str(exc)
-        if exc_str == '':
-            exc_str = str(type(exc))
-        err = domain + ': ' + exc_str
+        err = error_message(domain, exc)
     finally:
+        if scts_tls:
+            tls_ext_18_tdf = _tls_ext_18_tdfs.pop(ssl_address(sock._ssl), None)
         sock.close()
 
     ee_cert_der = None
     if ee_cert_x509:
-        ee_cert_der = OpenSSL.crypto.dump_certificate(
-            type=OpenSSL.crypto.FILETYPE_ASN1,
-            cert=ee_cert_x509)
+        ee_cert_der = cert_der_from_x509(ee_cert_x509)
 
     issuer_cert_der = None
     if issuer_cert_x509:
         # https://tools.ietf.org/html/rfc5246#section-7.4.2
-        issuer_cert_der = OpenSSL.crypto.dump_certificate(
-            type=OpenSSL.crypto.FILETYPE_ASN1,
-            cert=issuer_cert_x509)
-
-    more_issuer_cert_der_candidates = [
-        OpenSSL.crypto.dump_certificate(type=OpenSSL.crypto.FILETYPE_ASN1,
-                                        cert=cert_509)
-        for cert_509
-        in more_issuer_cert_x509_candidates
-    ]
+        issuer_cert_der = cert_der_from_x509(issuer_cert_x509)
 
     return TlsHandshakeResult(ee_cert_der, issuer_cert_der,
-                              more_issuer_cert_der_candidates,
+                              more_issuer_cert_x509_candidates,
                               ocsp_resp_der, tls_ext_18_tdf,
                               err)
+
+
+def do_handshake(domain, port=443, scts_tls=True, scts_ocsp=True, timeout=5):
+    '''
+     Args:
+         domain: string with domain name,
+                 for example: 'ritter.vg', or 'www.ritter.vg'
+         scts_tls: If True, register callback for TSL extension 18 (for SCTs)
+         scts_ocsp: If True, register callback for OCSP-response (for SCTs)
+         timeout(int): timeout in seconds
+     '''
+    sock = create_connection(domain, scts_tls, scts_ocsp, timeout)
+    err = ''
+    try:
+        sock.connect((domain, port))
+        sock.do_handshake()
+    except Exception as exc:
+        err = error_message(domain, exc)
+    return handshake_result(domain, sock, scts_tls, scts_ocsp, err)
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+async def _wait_for_socket(sock, writable=False):
+    '''Wait until the non-blocking socket `sock` is readable (or writable).'''
+    loop = asyncio.get_event_loop()
+    if writable:
+        add, remove = loop.add_writer, loop.remove_writer
+    else:
+        add, remove = loop.add_reader, loop.remove_reader
+    fd = sock.fileno()
+    future = loop.create_future()
+    add(fd, _set_done, future)
+    try:
+        await future
+    finally:
+        remove(fd)
+
+
+async def _resolve(domain, port):
+    loop = asyncio.get_event_loop()
+    addrinfos = await loop.getaddrinfo(domain, port, family=socket.AF_INET,
+                                       type=socket.SOCK_STREAM)
+    return addrinfos[0][4]
+
+
+async def _connect_and_handshake(sock, address):
+    sock.setblocking(False)
+    errnum = sock.connect_ex(address)
+    if errnum in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+        await _wait_for_socket(sock, writable=True)
+        errnum = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if errnum != 0:
+        raise OSError(errnum, os.strerror(errnum))
+
+    while True:
+        try:
+            sock.do_handshake()
+            return
+        except OpenSSL.SSL.WantReadError:
+            await _wait_for_socket(sock)
+        except OpenSSL.SSL.WantWriteError:
+            await _wait_for_socket(sock, writable=True)
+
+
+async def do_handshake_async(domain, port=443, scts_tls=True, scts_ocsp=True,
+                             timeout=5):
+    '''Coroutine version of `do_handshake()`.
+
+    The connection is non-blocking and the event loop waits for the socket
+    while connecting and handshaking, so a lot of handshakes can be in flight
+    concurrently in one thread.  Unlike `do_handshake()`, connect and
+    handshake are cancelled after `timeout` seconds.  The timeout starts after
+    the name resolution, which can be queued behind other lookups in the
+    executor of the event loop.
+    '''
+    sock = create_connection(domain, scts_tls, scts_ocsp, timeout)
+    err = ''
+    try:
+        address = await _resolve(domain, port)
+        await asyncio.wait_for(_connect_and_handshake(sock, address), timeout)
+    except asyncio.TimeoutError:
+        err = '%s: timed out after %ds' % (domain, timeout)
+    except Exception as exc:
+        err = error_message(domain, exc)
+    return handshake_result(domain, sock, scts_tls, scts_ocsp, err)
+
+
+'''disk cache of handshake results, cf. `cached_handshake_result()`'''
+HANDSHAKE_CACHE = join(expanduser('~'), '.cache', 'ctzzy', 'hosts')
+HANDSHAKE_CACHE_TTL = 24 * 60 * 60  # seconds
+
+
+def open_handshake_cache(filename=HANDSHAKE_CACHE):
+    '''Return the disk cache of handshake results (a `shelve.Shelf`), or None
+    if it could not be opened.
+    '''
+    try:
+        os.makedirs(dirname(filename), exist_ok=True)
+        return shelve.open(filename)
+    except dbm.error as exc:
+        logger.debug('could not open handshake cache: %s' % exc)
+        return None
+
+
+def _handshake_cache_key(domain, port, scts_tls, scts_ocsp):
+    # without the callbacks registered the result would lack TLS or OCSP SCTs
+    return '%s:%d:%d:%d' % (domain, port, scts_tls, scts_ocsp)
+
+
+def cached_handshake_result(cache, domain, port=443, scts_tls=True,
+                            scts_ocsp=True, ttl=HANDSHAKE_CACHE_TTL):
+    '''Return the TlsHandshakeResult of `domain` from `cache` if it has been
+    cached not longer than `ttl` seconds ago, else None.
+
+    Args:
+        cache(shelve.Shelf): opened by `open_handshake_cache()`, or None
+    '''
+    if cache is None:
+        return None
+    key = _handshake_cache_key(domain, port, scts_tls, scts_ocsp)
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if time.time() - entry['timestamp'] > ttl:
+        # expired, so it is replaced by the result of a new handshake
+        del cache[key]
+        return None
+    # the candidates are only needed DER encoded, so they are not parsed into
+    # <OpenSSL.crypto.X509> again
+    return TlsHandshakeResult(entry['ee_cert_der'], entry['issuer_cert_der'],
+                              more_issuer_cert_x509_candidates=None,
+                              ocsp_resp_der=entry['ocsp_resp_der'],
+                              tls_ext_18_tdf=entry['tls_ext_18_tdf'],
+                              err='',
+                              more_issuer_cert_ders=entry[
+                                  'more_issuer_cert_der_candidates'])
+
+
+def cache_handshake_result(cache, domain, port, scts_tls, scts_ocsp, res):
+    '''Store the TlsHandshakeResult `res` of `domain` in `cache`.  Failed
+    handshakes are not cached, the error could be a temporary one.
+
+    Args:
+        cache(shelve.Shelf): opened by `open_handshake_cache()`, or None
+    '''
+    if cache is None or res.err:
+        return
+    # this DER encodes the issuer cert candidates, which otherwise would be
+    # done lazily, only if needed
+    cache[_handshake_cache_key(domain, port, scts_tls, scts_ocsp)] = {
+        'ee_cert_der': res.ee_cert_der,
+        'issuer_cert_der': res.issuer_cert_der,
+        'more_issuer_cert_der_candidates': res.more_issuer_cert_der_candidates,
+        'ocsp_resp_der': res.ocsp_resp_der,
+        'tls_ext_18_tdf': res.tls_ext_18_tdf,
+        'timestamp': time.time(),
+    }
@@ -33,27 +33,44 @@ def create_ffibuilder():
             // for TLS extension 18
             typedef struct ssl_ctx_st SSL_CTX;
             typedef struct ssl_st SSL;
-            typedef int (*custom_ext_add_cb) (SSL *s, unsigned int ext_type,
-                                              const unsigned char **out,
-                                              size_t *outlen, int *al,
-                                              void *add_arg);
-            typedef void (*custom_ext_free_cb) (SSL *s, unsigned int ext_type,
-                                                const unsigned char *out,
-                                                void *add_arg);
-            typedef int (*custom_ext_parse_cb) (SSL *s, unsigned int ext_type,
-                                                const unsigned char *in,
-                                                size_t inlen, int *al,
-                                                void *parse_arg);
-            int SSL_CTX_add_client_custom_ext(SSL_CTX *ctx, unsigned int ext_type,
-                                              custom_ext_add_cb add_cb,
-                                              custom_ext_free_cb free_cb,
-                                              void *add_arg,
-                                              custom_ext_parse_cb parse_cb,
-                                              void *parse_arg);
+            typedef struct x509_st X509;
+            #define SSL_EXT_IGNORE_ON_RESUMPTION ...
+            #define SSL_EXT_CLIENT_HELLO ...
+            #define SSL_EXT_TLS1_2_SERVER_HELLO ...
+            #define SSL_EXT_TLS1_3_CERTIFICATE ...
+            typedef int (*SSL_custom_ext_add_cb_ex) (SSL *s,
+                                                     unsigned int ext_type,
+                                                     unsigned int context,
+                                                     const unsigned char **out,
+                                                     size_t *outlen, X509 *x,
+                                                     size_t chainidx, int *al,
+                                                     void *add_arg);
+            typedef void (*SSL_custom_ext_free_cb_ex) (SSL *s,
+                                                       unsigned int ext_type,
+                                                       unsigned int context,
+                                                       const unsigned char *out,
+                                                       void *add_arg);
+            typedef int (*SSL_custom_ext_parse_cb_ex) (SSL *s,
+                                                       unsigned int ext_type,
+                                                       unsigned int context,
+                                                       const unsigned char *in,
+                                                       size_t inlen, X509 *x,
+                                                       size_t chainidx, int *al,
+                                                       void *parse_arg);
+            int SSL_CTX_add_custom_ext(SSL_CTX *ctx, unsigned int ext_type,
+                                       unsigned int context,
+                                       SSL_custom_ext_add_cb_ex add_cb,
+                                       SSL_custom_ext_free_cb_ex free_cb,
+                                       void *add_arg,
+                                       SSL_custom_ext_parse_cb_ex parse_cb,
+                                       void *parse_arg);
             extern "Python" static int serverinfo_cli_parse_cb(SSL *s,
                                                                unsigned int ext_type,
+                                                               unsigned int context,
                                                                const unsigned char *in,
                                                                size_t inlen,
+                                                               X509 *x,
+                                                               size_t chainidx,
                                                                int *al, void *arg);
         '''
     ffibuilder = FFI()
@@ -44,3 +44,32 @@ def setup_logging(loglevel):
     logger.addHandler(err_handler)
 
     return logger
+
+
+class BufferedOutput(list):
+    '''Output lines collected by `info()`, `verbose()` and `debug()` and
+    written at once by `flush()`.
+
+    The lines of disabled log levels are dropped right away, the others are
+    written as one log record, so they are not interleaved with the output of
+    other hosts and the handler lock is acquired only once.
+    '''
+
+    def _add(self, level, message):
+        if logger.isEnabledFor(level):
+            self.append(message)
+
+    def info(self, message):
+        self._add(logging.INFO, message)
+
+    def verbose(self, message):
+        self._add(VERBOSE, message)
+
+    def debug(self, message):
+        self._add(logging.DEBUG, message)
+
+    def flush(self):
+        if self:
+            # every collected line passed its level check already
+            logger.info('\n'.join(self))
+            del self[:]
@@ -9,6 +9,12 @@ def to_hex(val):
     except NameError:
         pass
     # else:
+    try:
+        # Python-3.8+, also for a memoryview
+        return val.hex(':')
+    except (AttributeError, TypeError):
+        # no separator argument before Python-3.8
+        pass
     try:
         # Python-2.x
         return ":".join("{0:02x}".format(ord(char)) for char in val)
@@ -78,11 +78,11 @@ setup(
     package_data={'ctzzy': ['really_all_logs.json', 'log_list_schema.json'], },
     install_requires=[
         'cffi>=1.4.0',
-        'cryptography>=2.8.0',
+        'cryptography>=2.9.0',
         'html2text>=2016.9.19',
         'pyasn1>=0.4.0',
         'pyasn1-modules>=0.2.0',
-        'pyOpenSSL>=18.0.0',
+        'pyOpenSSL>=20.0.0',
         'requests>=2.20.0',
         'utlz>=0.10.0',
     ],